@@ -289,19 +289,19 @@ def main():
 
     # load neural networks
     model_1_path = ROOT_DIRECTORY / "assets" / 'julia_net.pth'
-    model_1 = torch.load(model_1_path).cpu()
+    model_1 = torch.load(model_1_path, weights_only=False).cpu()
 
     model_2_path = ROOT_DIRECTORY / "assets" / 'manet_19_00_26_09.pth'
-    model_2 = torch.load(model_2_path).cpu()
+    model_2 = torch.load(model_2_path, weights_only=False).cpu()
 
     model_3_path = ROOT_DIRECTORY / "assets" / 'fpn_01_00_22_09.pth'
-    model_3 = torch.load(model_3_path).cpu()
+    model_3 = torch.load(model_3_path, weights_only=False).cpu()
 
     model_4_path = ROOT_DIRECTORY / "assets" / 'fpn_15_00_26_09.pth'
-    model_4 = torch.load(model_4_path).cpu()
+    model_4 = torch.load(model_4_path, weights_only=False).cpu()
 
     model_5_path = ROOT_DIRECTORY / "assets" / 'fpn_14_00_26_09.pth'
-    model_5 = torch.load(model_5_path).cpu()
+    model_5 = torch.load(model_5_path, weights_only=False).cpu()
 
     for chip_id in tqdm(chip_ids, miniters=25, file=sys.stdout, leave=True):
         # figure out where this prediction data should go
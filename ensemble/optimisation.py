@@ -91,19 +91,19 @@ def _objective(parameters_dict, model_1, model_2, model_3, model_4, model_5):
 
 # Load all neural networks
 model_1_path = ASSETS_DIRECTORY / 'julia_net.pth'
-model_1 = torch.load(model_1_path).to('cuda')
+model_1 = torch.load(model_1_path, weights_only=False).to('cuda')
 
 model_2_path = ASSETS_DIRECTORY / 'manet_19_00_26_09.pth'
-model_2 = torch.load(model_2_path).to('cuda')
+model_2 = torch.load(model_2_path, weights_only=False).to('cuda')
 
 model_3_path = ASSETS_DIRECTORY / 'fpn_01_00_22_09.pth'
-model_3 = torch.load(model_3_path).to('cuda')
+model_3 = torch.load(model_3_path, weights_only=False).to('cuda')
 
 model_4_path = ASSETS_DIRECTORY / 'fpn_15_00_26_09.pth'
-model_4 = torch.load(model_4_path).to('cuda')
+model_4 = torch.load(model_4_path, weights_only=False).to('cuda')
 
 model_5_path = ASSETS_DIRECTORY / 'fpn_14_00_26_09.pth'
-model_5 = torch.load(model_5_path).to('cuda')
+model_5 = torch.load(model_5_path, weights_only=False).to('cuda')
 
 parameters_dict = get_parameters_dict()
 
@@ -3,16 +3,25 @@ import torch.utils.data as data_utils
 
 from segtat.explorer import ModelExplorer
 
-explorer = ModelExplorer(working_dir='D:/segmentation', device='cuda')
-# Load data as PyTorch tensors
-x_train, y_train = explorer.load_data(features_path='D:/segmentation/converted_no_missing/X_train.pt',
-                                      target_path='D:/segmentation/converted_no_missing/Y_train.pt',
-                                      as_np=False)
-x_train = x_train.float()
-validation = data_utils.TensorDataset(x_train, y_train)
-# Validate model on the test dataset
-for th in [0.005]:
-    print(f'Threshold: {th}')
-    metrics = [smp.utils.metrics.IoU(threshold=th)]
-    explorer.validate(validation, model_path='D:/segmentation/pan_00_00_29_09.pth',
-                      metrics=metrics, threshold=th, vis=True)
+# DataLoader workers import this module, so the code is launched only in the main process
+if __name__ == '__main__':
+    explorer = ModelExplorer(working_dir='D:/segmentation', device='cuda')
+    # Load data as PyTorch tensors
+    x_train, y_train = explorer.load_data(features_path='D:/segmentation/converted_no_missing/X_train.pt',
+                                          target_path='D:/segmentation/converted_no_missing/Y_train.pt',
+                                          as_np=False)
+    x_train = x_train.float()
+    validation = data_utils.TensorDataset(x_train, y_train)
+    # Weights from the checkpoint are loaded into the model with the same architecture
+    nn_model = smp.PAN(encoder_name="resnet18",
+                       encoder_weights=None,
+                       in_channels=6,
+                       classes=1,
+                       activation='sigmoid')
+    # Validate model on the test dataset
+    for th in [0.005]:
+        print(f'Threshold: {th}')
+        metrics = [smp.utils.metrics.IoU(threshold=th)]
+        explorer.validate(validation, model_path='D:/segmentation/pan_00_00_29_09.pth',
+                          model=nn_model, metrics=metrics)
+        explorer.visualize(validation, nn_model, threshold=th)
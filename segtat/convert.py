@@ -305,7 +305,8 @@ def convert_geotiff_into_pt(features_path: str, label_path: str, save_path: str,
         features_tensor.append(stacked_matrix)
         target_tensor.append([label_matrix])
 
-    features_tensor = np.array(features_tensor)
+    # float32 matches the model input, so memory-mapped loading needs no copy
+    features_tensor = np.array(features_tensor, dtype=np.float32)
     target_tensor = np.array(target_tensor)
 
     # Numpy arrays into tensors
@@ -0,0 +1,46 @@
+import torch
+import segmentation_models_pytorch as smp
+
+PRECISIONS = {'fp32': torch.float32, 'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+class MixedPrecisionTrainEpoch(smp.utils.train.TrainEpoch):
+    """ Train epoch with automatic mixed precision. Forward pass is performed
+    in bfloat16 or float16 inside autocast, loss - in float32. For float16
+    gradients are scaled with GradScaler to prevent underflow
+
+    :param precision: 'fp32', 'bf16' or 'fp16' (CUDA devices only)
+    :param scheduler: learning rate scheduler, which is called after every
+    optimizer step
+    """
+
+    def __init__(self, model, loss, metrics, optimizer, device: str = 'cpu',
+                 verbose: bool = True, precision: str = 'fp32', scheduler=None):
+        if precision not in PRECISIONS:
+            raise ValueError(f'precision must be one of {list(PRECISIONS)}, got {precision}')
+        device_type = 'cuda' if str(device).startswith('cuda') else 'cpu'
+        if precision == 'fp16' and device_type != 'cuda':
+            raise ValueError(f'fp16 precision is supported only on CUDA devices, got {device}')
+        super().__init__(model=model, loss=loss, metrics=metrics, optimizer=optimizer,
+                         device=device, verbose=verbose)
+        self.device_type = device_type
+        self.dtype = PRECISIONS[precision]
+        self.use_autocast = precision != 'fp32'
+        self.scaler = torch.amp.GradScaler('cuda', enabled=precision == 'fp16')
+        self.scheduler = scheduler
+
+    def batch_update(self, x, y):
+        self.optimizer.zero_grad()
+        with torch.autocast(device_type=self.device_type, dtype=self.dtype, enabled=self.use_autocast):
+            prediction = self.model.forward(x)
+        prediction = prediction.float()
+        loss = self.loss(prediction, y)
+
+        self.scaler.scale(loss).backward()
+        scale = self.scaler.get_scale()
+        self.scaler.step(self.optimizer)
+        self.scaler.update()
+        # Scale decreases only when optimizer step was skipped because of inf/nan gradients
+        if self.scheduler is not None and self.scaler.get_scale() >= scale:
+            self.scheduler.step()
+        return loss, prediction
@@ -1,20 +1,25 @@
+import math
 import os
+import pickle
 import random
+from contextlib import contextmanager
+from functools import lru_cache
 
 import torch
+import torch.distributed as dist
 import torch.utils.data as data_utils
-import segmentation_models_pytorch as smp
+from torch.nn.parallel import DistributedDataParallel
 import numpy as np
-import matplotlib.pyplot as plt
-import albumentations
-import matplotlib.pyplot as plt
-from segtat.metrics import XEDiceLoss
 
 
 class ModelExplorer:
     """ Class for launching PyTorch Neural networks """
 
     def __init__(self, working_dir: str, device: str = 'cpu'):
+        # segmentation_models_pytorch, albumentations and matplotlib are imported
+        # only when needed, because they take seconds to import
+        import segmentation_models_pytorch as smp
+
         self.working_dir = working_dir
         # Loss for all models will be the same
         self.loss = smp.utils.losses.DiceLoss()
@@ -22,111 +27,267 @@ class ModelExplorer:
 
     def fit(self, train: torch.tensor, model, **params):
         """ Perform train procedure.
-        In **params dict with hyperparameters for neural network can be defined
-
-        :param train: tensor with data for train
+        In **params dict with hyperparameters for neural network can be defined.
+        If params['augmentation'] is True, train part is extended with transformed
+        copies of samples, which are generated on the fly in DataLoader workers.
+
+        When the script is launched with torchrun (for example,
+        torchrun --standalone --nproc_per_node=N script.py), the model is trained
+        with DistributedDataParallel: every process uses its own GPU and part
+        of the train samples, validation is performed and the models are saved
+        only by the process with rank 0.
+
+        params['precision'] defines numbers format for training: 'fp32' (default),
+        'bf16' or 'fp16' (automatic mixed precision, CUDA only). Learning rate is changed
+        every batch with one cycle policy up to params['lr'] (by default - initial
+        learning rate of the optimizer), params['scheduler'] = False disables it.
+        If the optimizer uses momentum, it is cycled too (for Adam - the first
+        beta). Model and features are
+        converted to channels last memory format, unless params['channels_last']
+        is False.
+
+        On CUDA devices model is compiled with torch.compile (mode 'reduce-overhead')
+        if params['compile'] is not False. First iterations are slower because of
+        compilation, next ones use fused kernels and CUDA graphs.
+
+        Progress bars and messages are disabled with params['verbose'] = False.
+
+        Batches are prepared in params['num_workers'] processes (half of the cores
+        by default, 0 on Windows). Worker processes import the launching script,
+        so with workers it must start training under if __name__ == '__main__'
+
+        :param train: dataset with data for train
         :param model: class PyTorch model
         """
+        import segmentation_models_pytorch as smp
+        from segtat.epochs import MixedPrecisionTrainEpoch
+
         path_to_save = os.path.join(self.working_dir, 'best_model.pth')
         path_prom_save = os.path.join(self.working_dir, 'prom.pth')
-        train_dataset, valid_dataset = self.train_test(train.tensors[0], train.tensors[1], train_size=0.95)
-        # Prepare data loaders
-        train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=params['batch_size'])
-        valid_loader = torch.utils.data.DataLoader(valid_dataset, batch_size=1, shuffle=False)
+
+        world_size = int(os.environ.get('WORLD_SIZE', 1))
+        distributed = world_size > 1
+        rank = 0
+        init_group = False
+        if distributed:
+            rank = int(os.environ['RANK'])
+            local_rank = int(os.environ['LOCAL_RANK'])
+            if self.device.startswith('cuda'):
+                self.device = f'cuda:{local_rank}'
+                torch.cuda.set_device(local_rank)
+            if not dist.is_initialized():
+                dist.init_process_group('nccl' if self.device.startswith('cuda') else 'gloo')
+                init_group = True
+        is_main = rank == 0
+        # Only the main process reports progress
+        verbose = params.get('verbose', True) and is_main
+
+        # Split must be the same for all processes
+        train_dataset, valid_dataset = self._split(train, train_size=0.95, seed=params.get('seed', 42))
+        if params.get('augmentation') is True:
+            train_dataset = AugmentedDataset(train_dataset)
+
+        # Prepare data loaders, by default half of the cores are shared between processes
+        num_workers = params.get('num_workers', _default_num_workers((os.cpu_count() or 2) // 2 // world_size))
+        channels_last = params.get('channels_last', True)
+        train_sampler = None
+        if distributed:
+            train_sampler = data_utils.DistributedSampler(train_dataset, shuffle=True)
+        train_loader = self._loader(train_dataset, batch_size=params['batch_size'],
+                                    shuffle=train_sampler is None, num_workers=num_workers,
+                                    sampler=train_sampler, channels_last=channels_last)
+        valid_loader = self._loader(valid_dataset, batch_size=1, shuffle=False,
+                                    num_workers=num_workers, channels_last=channels_last)
+
+        base_model = model.to(self.device)
+        if channels_last:
+            base_model = base_model.to(memory_format=torch.channels_last)
+        if self.device.startswith('cuda'):
+            # Input size is fixed, so cuDNN can choose the fastest algorithms once
+            torch.backends.cudnn.benchmark = True
+
+        # Weights are saved from base_model, wrapped model is used for training
+        model = base_model
+        if distributed:
+            device_ids = [local_rank] if self.device.startswith('cuda') else None
+            model = DistributedDataParallel(base_model, device_ids=device_ids)
+        if params.get('compile', self.device.startswith('cuda')) and hasattr(torch, 'compile'):
+            model = torch.compile(model, mode='reduce-overhead', fullgraph=False)
 
         optimizer = params['optimizer']
-        train_epoch = smp.utils.train.TrainEpoch(
+        scheduler = None
+        total_steps = params['epochs'] * len(train_loader)
+        if params.get('scheduler', True) and total_steps > 0:
+            # Momentum is cycled only if optimizer uses it (momentum in SGD, betas in Adam)
+            defaults = optimizer.defaults
+            cycle_momentum = defaults.get('momentum', 0) > 0 or defaults.get('betas', (0, 0))[0] > 0
+            scheduler = torch.optim.lr_scheduler.OneCycleLR(optimizer,
+                                                            max_lr=params.get('lr', optimizer.param_groups[0]['lr']),
+                                                            total_steps=total_steps,
+                                                            cycle_momentum=cycle_momentum)
+        train_epoch = MixedPrecisionTrainEpoch(
             model,
             loss=self.loss,
             metrics=params['metrics'],
             optimizer=optimizer,
             device=self.device,
-            verbose=True,
+            verbose=verbose,
+            precision=params.get('precision', 'fp32'),
+            scheduler=scheduler,
         )
 
+        # In distributed mode validation is performed only by the main process
+        # with the model without DDP wrapper
         valid_epoch = smp.utils.train.ValidEpoch(
-            model,
+            base_model if distributed else model,
             loss=self.loss,
             metrics=params['metrics'],
             device=self.device,
-            verbose=True,
+            verbose=verbose,
         )
 
         for i in range(0, params['epochs']):
+            if train_sampler is not None:
+                train_sampler.set_epoch(i)
 
-            print('\nEpoch: {}'.format(i))
+            if verbose:
+                print('\nEpoch: {}'.format(i))
             train_logs = train_epoch.run(train_loader)
-            valid_logs = valid_epoch.run(valid_loader)
-
-            # When it takes only 0.8 set
-            if i == round(params['epochs']*0.8):
-                # Decrease decoder learning rate to 1e-5
-                optimizer.param_groups[0]['lr'] = 0.000002
-            if i == 10 or i == 20 or i == 30 or i == 40 or i == 50:
-                torch.save(model, path_prom_save)
-
-        torch.save(model, path_to_save)
-        print('Model saved!')
-        return model
-
-    def validate(self, test: torch.tensor, model_path: str, model=None,
-                 threshold: float = None, **params):
-        """ Perform validation on the test set
+            if is_main:
+                valid_logs = valid_epoch.run(valid_loader)
+
+                if i in {10, 20, 30, 40, 50}:
+                    torch.save({'model': base_model.state_dict(), 'epoch': i}, path_prom_save)
+            if distributed:
+                # Other processes wait for validation of the main one
+                dist.barrier()
+
+        if is_main:
+            torch.save({'model': base_model.state_dict(), 'epoch': params['epochs'] - 1}, path_to_save)
+            if verbose:
+                print('Model saved!')
+        if init_group:
+            dist.destroy_process_group()
+        return base_model
+
+    def validate(self, test: torch.tensor, model_path: str, model=None, **params):
+        """ Perform validation on the test set.
+        Batch size and number of DataLoader workers can be defined with
+        params['batch_size'] and params['num_workers'], progress bar is disabled
+        with params['verbose'] = False. By default 4 DataLoader workers are used
+        (0 on Windows), with workers the launching script must call validate under
+        if __name__ == '__main__'. Batch size is 1 by default: smp metrics are
+        calculated for the whole batch and then averaged over batches, so other
+        values give different metrics for the same model
 
         :param test: tensor with test data
-        :param model_path: path to the serialised PyTorch model
-        :param model: class PyTorch model
-        :param threshold: threshold for class definition
+        :param model_path: path to the checkpoint with model state_dict (saved by
+        fit) or to the whole pickled model
+        :param model: class PyTorch model with the same architecture, weights
+        from the checkpoint are loaded into it
+        :return: dictionary with loss and metrics values
         """
-        if model is None:
-            model = torch.load(model_path)
-
-        if params.get('vis') is not None and params['vis'] is True:
-            for i in range(0, 5):
-                n = np.random.choice(len(test))
-                features_tensor = test.tensors[0][n]
-                true_label = test.tensors[1][n]
-
-                x_tensor = features_tensor.to(self.device).unsqueeze(0)
-                pr_mask = model.predict(x_tensor)
-                if threshold is None:
-                    pr_mask = pr_mask.squeeze().cpu().numpy().astype(np.uint8)
-                else:
-                    pr_mask = pr_mask.squeeze().cpu().numpy()
-                    pr_mask[pr_mask < threshold] = 0
-                    pr_mask[pr_mask >= threshold] = 1
-
-                plt.imshow(pr_mask, cmap='Purples', alpha=1.0)
-                #plt.imshow(true_label.numpy()[0], cmap='Blues', alpha=0.2)
-                plt.colorbar()
-                plt.show()
-
-                plt.imshow(true_label.numpy()[0], cmap='Blues', alpha=0.9)
-                plt.colorbar()
-                plt.show()
+        import segmentation_models_pytorch as smp
 
-        test_loader = torch.utils.data.DataLoader(test)
+        if model is None:
+            raise ValueError('model instance must be defined to load state_dict from model_path')
+        try:
+            checkpoint = torch.load(model_path, map_location=self.device, mmap=True, weights_only=True)
+        except pickle.UnpicklingError:
+            # Old checkpoints are pickled modules, which can't be loaded in weights_only mode
+            checkpoint = torch.load(model_path, map_location=self.device, mmap=True, weights_only=False)
+        if isinstance(checkpoint, torch.nn.Module):
+            checkpoint = {'model': checkpoint.state_dict()}
+        model.load_state_dict(checkpoint['model'])
+        model = model.to(self.device)
+
+        test_loader = self._loader(test, batch_size=params.get('batch_size', 1), shuffle=False,
+                                   num_workers=params.get('num_workers', _default_num_workers(4)))
         test_epoch = smp.utils.train.ValidEpoch(
             model=model,
             loss=self.loss,
             metrics=params['metrics'],
             device=self.device,
+            verbose=params.get('verbose', True) and int(os.environ.get('RANK', 0)) == 0,
         )
 
         # Calculate loss
-        logs = test_epoch.run(test_loader)
+        with torch.inference_mode():
+            logs = test_epoch.run(test_loader)
+        return logs
+
+    def visualize(self, test: torch.tensor, model, threshold: float = None, n_samples: int = 5,
+                  seed: int = 0):
+        """ Show predicted and true labels for random samples from the test set
+
+        :param test: tensor with test data
+        :param model: class PyTorch model
+        :param threshold: threshold for class definition
+        :param n_samples: number of samples to show
+        :param seed: seed for samples choice
+        """
+        import matplotlib.pyplot as plt
+
+        model = model.to(self.device)
+        sample_idx = torch.randperm(len(test), generator=torch.Generator().manual_seed(seed))[:n_samples].tolist()
+        samples = [test[n] for n in sample_idx]
+        x_tensor = torch.stack([sample[0] for sample in samples]).to(self.device)
+
+        # All chosen samples are predicted at once without autograd tracking
+        with torch.inference_mode():
+            pr_masks = model.predict(x_tensor)
+            if threshold is None:
+                pr_masks = pr_masks.to(torch.uint8)
+            else:
+                pr_masks = (pr_masks >= threshold).to(torch.uint8)
+        pr_masks = pr_masks.cpu().numpy()
+
+        for pr_mask, (_, true_label) in zip(pr_masks, samples):
+            plt.imshow(pr_mask[0], cmap='Purples', alpha=1.0)
+            plt.colorbar()
+            plt.show()
+
+            plt.imshow(true_label.numpy()[0], cmap='Blues', alpha=0.9)
+            plt.colorbar()
+            plt.show()
+
+    def _loader(self, dataset: data_utils.Dataset, batch_size: int, shuffle: bool,
+                num_workers: int, sampler: data_utils.Sampler = None,
+                channels_last: bool = False):
+        """ Create DataLoader which puts batches into pinned memory and sends
+        them to the device asynchronously
+
+        :param dataset: dataset to iterate over
+        :param batch_size: number of samples in batch
+        :param shuffle: is it needed to shuffle samples every epoch
+        :param num_workers: number of processes for batches preparation
+        :param sampler: sampler for samples order definition (shuffle must be False)
+        :param channels_last: is it needed to convert features to channels last format
+        """
+        loader_params = {}
+        if num_workers > 0:
+            loader_params = {'persistent_workers': True, 'prefetch_factor': 4}
+        loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=shuffle,
+                                             sampler=sampler, num_workers=num_workers,
+                                             pin_memory=self.device.startswith('cuda'),
+                                             **loader_params)
+        memory_format = torch.channels_last if channels_last else torch.preserve_format
+        return _DeviceLoader(loader, self.device, memory_format)
 
     @staticmethod
     def load_data(features_path: str, target_path: str, as_np: bool = False):
-        """ Load data from paths
+        """ Load data from paths. Tensors are memory-mapped, so the pages are
+        read from disk only when the samples are accessed. Changing the dtype
+        (e.g. calling .float() on float64 features) copies the whole tensor
+        into RAM, so save the features as float32
 
         :param features_path: path to the features .pt file
         :param target_path: path to the label .pt file
         :param as_np: is it needed to return tensors as numpy arrays
         """
 
-        x_train = torch.load(features_path)
-        y_train = torch.load(target_path)
+        x_train = torch.load(features_path, mmap=True, map_location='cpu')
+        y_train = torch.load(target_path, mmap=True, map_location='cpu')
 
         if as_np:
             x_train = x_train.numpy()
@@ -135,69 +296,96 @@ class ModelExplorer:
         return x_train, y_train
 
     @staticmethod
-    def train_test(x_train: torch.tensor, y_train: torch.tensor, train_size: float = 0.8):
-        """ Method for train test split
+    def train_test(x_train: torch.tensor, y_train: torch.tensor, train_size: float = 0.8,
+                   seed: int = 42):
+        """ Method for train test split. Returned datasets are views on the
+        same tensors, so the data is not copied
 
         :param x_train: pytorch tensor with features
         :param y_train: pytorch tensor with labels
         :param train_size: value from 0.1 to 0.9
+        :param seed: seed for reproducible split (None - use global random state)
+        """
+        dataset = data_utils.TensorDataset(x_train, y_train)
+        return ModelExplorer._split(dataset, train_size, seed)
+
+    @staticmethod
+    def _split(dataset: data_utils.Dataset, train_size: float, seed: int = None):
+        """ Divide dataset into two subsets with random samples
+
+        :param dataset: dataset to divide
+        :param train_size: value from 0.1 to 0.9
+        :param seed: seed for reproducible split
         """
         if train_size < 0.1 or train_size > 0.99:
             raise ValueError('train_size value must be value between 0.1 and 0.99')
-        dataset = data_utils.TensorDataset(x_train, y_train)
         train_ratio = round(len(dataset) * train_size)
         test_ratio = len(dataset) - train_ratio
-        train, test = torch.utils.data.random_split(dataset, [train_ratio, test_ratio])
-
-        train_features, train_target = train.dataset[train.indices]
-        test_features, test_target = test.dataset[test.indices]
-        train_dataset = data_utils.TensorDataset(train_features, train_target)
-        test_dataset = data_utils.TensorDataset(test_features, test_target)
-        return train_dataset, test_dataset
+        generator = torch.default_generator
+        if seed is not None:
+            generator = torch.Generator().manual_seed(seed)
+        train, test = torch.utils.data.random_split(dataset, [train_ratio, test_ratio],
+                                                    generator=generator)
+        return train, test
 
     @staticmethod
-    def augmentation(dataset: torch.tensor, vis: bool = False) -> data_utils.TensorDataset:
-        """ Perform augmentation procedure """
-        transformations = albumentations.Compose(
-            [
-                albumentations.ShiftScaleRotate(),
-                albumentations.HorizontalFlip(),
-                albumentations.VerticalFlip()
-            ]
-        )
-
-        features = dataset.tensors[0].numpy()
-        features_shape = features.shape
-        targets = dataset.tensors[1].numpy()
-
-        # Include test labels into array
-        stacked = np.concatenate([features, targets], axis=1)
-        random.seed(7)
-
-        # Perform transforms
-        # TODO make it more effective
-        for i in range(0, len(features)):
-            print(i)
-            image = stacked[i, 0:features_shape[1], :, :]
-            mask = stacked[i, features_shape[1], :, :]
-            mask = np.array([mask])
-            transformed = transformations(image=image, mask=mask)
-
-            augmented_features = transformed["image"]
-            augmented_label = transformed["mask"]
-
-            if vis:
-                plt.imshow(stacked[i, 0, :, :], cmap='jet')
+    def augmentation(dataset: torch.tensor, vis: bool = False, n_jobs: int = -1,
+                     device: str = None, batch_size: int = 64) -> data_utils.TensorDataset:
+        """ Perform augmentation procedure. By default samples are transformed
+        with Albumentations in several processes. If device is defined, batches
+        of samples are transformed with Kornia on this device (for example, 'cuda')
+
+        :param dataset: TensorDataset (or its Subset) with features and labels
+        :param vis: is it needed to show original and transformed matrices
+        :param n_jobs: number of processes for augmentation (-1 - all cores)
+        :param device: device for augmentation with Kornia
+        :param batch_size: number of samples transformed at once with Kornia
+        """
+        from joblib import Parallel, delayed, effective_n_jobs
+
+        features_tensor, targets_tensor = _dataset_tensors(dataset)
+        # Numpy arrays share memory with the tensors
+        features = features_tensor.numpy()
+        targets = targets_tensor.numpy()
+
+        if device is not None:
+            augmented_all_features, augmented_all_labels = _augment_batches(features_tensor, targets_tensor,
+                                                                            device, batch_size)
+        else:
+            # Perform transforms in separate processes, every sample has its own seed.
+            # Processes get ranges of indices, whole arrays are memory-mapped by joblib once
+            chunk_size = max(1, math.ceil(len(features) / (effective_n_jobs(n_jobs) * 4)))
+            starts = range(0, len(features), chunk_size)
+            results = Parallel(n_jobs=n_jobs, backend='loky')(
+                delayed(_augment_chunk)(features, targets, start, start + chunk_size) for start in starts)
+
+            # Write chunks into preallocated tensors through numpy views
+            augmented_all_features = torch.empty_like(features_tensor)
+            augmented_all_labels = torch.empty_like(targets_tensor)
+            augmented_features_view = augmented_all_features.numpy()
+            augmented_labels_view = augmented_all_labels.numpy()
+            for start, (augmented_features, augmented_labels) in zip(starts, results):
+                augmented_features_view[start:start + len(augmented_features)] = augmented_features
+                augmented_labels_view[start:start + len(augmented_labels), 0] = augmented_labels
+
+        if vis:
+            import matplotlib.pyplot as plt
+
+            for i in range(0, len(features)):
+                augmented_features = augmented_all_features[i].numpy()
+                augmented_label = augmented_all_labels[i].numpy()
+
+                plt.imshow(features[i, 0, :, :], cmap='jet')
                 plt.title('Исходная матрица VH')
                 plt.colorbar()
                 plt.show()
 
-                plt.imshow(stacked[i, 1, :, :], cmap='jet')
+                plt.imshow(features[i, 1, :, :], cmap='jet')
                 plt.title('Исходная матрица VV')
                 plt.colorbar()
                 plt.show()
 
-                plt.imshow(stacked[i, 2, :, :], cmap='Blues')
+                plt.imshow(targets[i, 0, :, :], cmap='Blues')
                 plt.title('Исходная матрица label')
                 plt.colorbar()
                 plt.show()
@@ -217,17 +405,195 @@ class ModelExplorer:
                 plt.colorbar()
                 plt.show()
 
-            # Add dimension
-            augmented_features = np.array([augmented_features])
-            augmented_label = np.array([augmented_label])
-            if i == 0:
-                augmented_all_features = augmented_features
-                augmented_all_labels = augmented_label
-            else:
-                augmented_all_features = np.concatenate([augmented_all_features, augmented_features])
-                augmented_all_labels = np.concatenate([augmented_all_labels, augmented_label])
-
-        features = np.concatenate([features, augmented_all_features])
-        targets = np.concatenate([targets, augmented_all_labels])
+        features_tensor = torch.cat([features_tensor, augmented_all_features])
+        targets_tensor = torch.cat([targets_tensor, augmented_all_labels])
         print('Augmentation finished')
-        return data_utils.TensorDataset(torch.from_numpy(features), torch.from_numpy(targets))
+        return data_utils.TensorDataset(features_tensor, targets_tensor)
+
+
+def _default_num_workers(num_workers: int) -> int:
+    """ Number of DataLoader workers if it is not defined by the user. On Windows
+    workers are spawned and re-import the launching script, so they are not used
+    """
+    if os.name == 'nt':
+        return 0
+    return num_workers
+
+
+class _DeviceLoader:
+    """ Wrapper for DataLoader which moves batches to the device without blocking.
+    smp epochs call .to(device) for every batch, which is no-op for such tensors
+
+    :param loader: DataLoader with features and labels
+    :param device: device to move batches to
+    :param memory_format: memory format for features
+    """
+
+    def __init__(self, loader: data_utils.DataLoader, device: str,
+                 memory_format: torch.memory_format = torch.preserve_format):
+        self.loader = loader
+        self.device = device
+        self.memory_format = memory_format
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        for features, label in self.loader:
+            features = features.to(self.device, memory_format=self.memory_format, non_blocking=True)
+            yield features, label.to(self.device, non_blocking=True)
+
+
+class AugmentedDataset(data_utils.Dataset):
+    """ Dataset which applies augmentation on the fly. First len(dataset) samples
+    are the original ones, the second half - their transformed copies
+
+    :param dataset: dataset with features and labels tensors
+    """
+
+    def __init__(self, dataset: data_utils.Dataset):
+        self.dataset = dataset
+        # Pipeline is created in the process which uses it (see _pipeline)
+        self.transformations = None
+        self.pipeline_pid = None
+
+    def __len__(self):
+        return 2 * len(self.dataset)
+
+    def __getitem__(self, i: int):
+        n_samples = len(self.dataset)
+        if i < n_samples:
+            return self.dataset[i]
+
+        features, label = self.dataset[i - n_samples]
+        transformed = self._pipeline()(image=features.numpy().transpose(1, 2, 0),
+                                       mask=label.numpy()[0])
+        augmented_features = torch.from_numpy(transformed["image"].transpose(2, 0, 1).copy())
+        augmented_label = torch.from_numpy(transformed["mask"][np.newaxis, :, :].copy())
+        return augmented_features, augmented_label
+
+    def _pipeline(self):
+        """ Create transformations on the first call in the current process.
+        In DataLoader workers pipeline is seeded with the worker seed, so workers
+        don't repeat random generators state copied from the parent process
+        """
+        if self.transformations is None or self.pipeline_pid != os.getpid():
+            self.transformations = _augmentation_pipeline()
+            self.pipeline_pid = os.getpid()
+            # Global random and np.random are already seeded by DataLoader in every worker
+            worker_info = data_utils.get_worker_info()
+            if worker_info is not None and hasattr(self.transformations, 'set_random_seed'):
+                self.transformations.set_random_seed(worker_info.seed % 2 ** 32)
+        return self.transformations
+
+
+def _dataset_tensors(dataset: data_utils.Dataset):
+    """ Get features and labels tensors from TensorDataset or its Subset """
+    if isinstance(dataset, data_utils.Subset):
+        features, labels = _dataset_tensors(dataset.dataset)
+        indices = torch.as_tensor(dataset.indices)
+        return features[indices], labels[indices]
+    return dataset.tensors
+
+
+@lru_cache(maxsize=1)
+def _augmentation_pipeline():
+    """ Create random transformations for features and label matrices.
+    Pipeline is created once per process and reused for all samples
+    """
+    import albumentations
+
+    return albumentations.Compose(
+        [
+            albumentations.ShiftScaleRotate(),
+            albumentations.HorizontalFlip(),
+            albumentations.VerticalFlip()
+        ]
+    )
+
+
+@contextmanager
+def _seeded_pipeline(transformations, seed: int):
+    """ Seed random generators which Albumentations samples transformation
+    parameters from. Old versions use global random and np.random, new ones -
+    generators of the Compose instance. State of the global generators is
+    restored on exit, so random state of the caller is not changed
+
+    :param transformations: Albumentations Compose
+    :param seed: seed value
+    """
+    random_state = random.getstate()
+    np_random_state = np.random.get_state()
+    random.seed(seed)
+    np.random.seed(seed)
+    if hasattr(transformations, 'set_random_seed'):
+        transformations.set_random_seed(seed)
+    try:
+        yield transformations
+    finally:
+        random.setstate(random_state)
+        np.random.set_state(np_random_state)
+
+
+def _augment_chunk(features: np.array, targets: np.array, start: int, end: int):
+    """ Apply random transformations to samples from start to end index.
+    Sample with index i is transformed with seed 7 + i
+
+    :param features: array with features (N, C, H, W)
+    :param targets: array with labels (N, 1, H, W)
+    :param start: index of the first sample
+    :param end: index after the last sample
+    :return: transformed features (n, C, H, W) and labels (n, H, W) arrays
+    """
+    transformations = _augmentation_pipeline()
+    augmented_features = []
+    augmented_labels = []
+    for i in range(start, min(end, len(features))):
+        # Albumentations expects channels last
+        with _seeded_pipeline(transformations, 7 + i):
+            transformed = transformations(image=features[i].transpose(1, 2, 0), mask=targets[i, 0])
+        augmented_features.append(transformed["image"].transpose(2, 0, 1))
+        augmented_labels.append(transformed["mask"])
+    return np.stack(augmented_features), np.stack(augmented_labels)
+
+
+def _augment_batches(features: torch.tensor, targets: torch.tensor, device: str, batch_size: int):
+    """ Apply random transformations to batches of samples with Kornia. The same
+    transformation is applied to features and label of every sample
+
+    :param features: tensor with features (N, C, H, W)
+    :param targets: tensor with labels (N, 1, H, W)
+    :param device: device to perform transformations on
+    :param batch_size: number of samples transformed at once
+    :return: transformed features and labels tensors
+    """
+    import kornia.augmentation as K
+
+    # Kornia analogue of ShiftScaleRotate, HorizontalFlip and VerticalFlip defaults,
+    # reflection padding is the closest mode to BORDER_REFLECT_101 of ShiftScaleRotate
+    transformations = K.AugmentationSequential(
+        K.RandomAffine(degrees=45, translate=(0.0625, 0.0625), scale=(0.9, 1.1),
+                       padding_mode='reflection', p=0.5),
+        K.RandomHorizontalFlip(),
+        K.RandomVerticalFlip(),
+        data_keys=['input', 'mask']
+    )
+
+    augmented_features = torch.empty_like(features)
+    augmented_labels = torch.empty_like(targets)
+    # Seed is applied only inside this block, random state of the caller is restored
+    cuda_devices = [torch.device(device)] if torch.device(device).type == 'cuda' else []
+    with torch.random.fork_rng(devices=cuda_devices), torch.no_grad():
+        torch.random.default_generator.manual_seed(7)
+        for cuda_device in cuda_devices:
+            with torch.cuda.device(cuda_device):
+                torch.cuda.manual_seed(7)
+
+        for start in range(0, len(features), batch_size):
+            end = start + batch_size
+            features_batch = features[start:end].to(device).float()
+            labels_batch = targets[start:end].to(device).float()
+            features_batch, labels_batch = transformations(features_batch, labels_batch)
+            augmented_features[start:end] = features_batch.cpu()
+            augmented_labels[start:end] = labels_batch.cpu()
+    return augmented_features, augmented_labels
@@ -284,7 +284,7 @@ for i in [0]:
         print('Decrease decoder learning rate to 1e-5!')
 
 # load best saved checkpoint
-best_model = torch.load('./best_model.pth')
+best_model = torch.load('./best_model.pth', weights_only=False)
 # create test dataset
 test_dataset = Dataset(
     x_test_dir,